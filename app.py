@@ -1,14 +1,31 @@
 # type: ignore
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 from datetime import datetime, timedelta
+from functools import lru_cache
 import os
 import pandas as pd
 import numpy as np
-from hashlib import md5, sha256
+import pyarrow as pa
+from pyarrow import csv as pa_csv
+from hashlib import md5, sha256, scrypt
+import hmac
 import json
-from PIL import Image
 import base64
+import csv
 import re
+import tempfile
+import stat
+import threading
+import queue
+import copy
+import atexit
+import logging
+
+try:
+    import orjson
+except ImportError:  # optional C parser; the standard library is used without it
+    orjson = None
 
 # Initialize session state
 if 'authenticated' not in st.session_state:
@@ -41,6 +58,68 @@ if 'trial_remaining' not in st.session_state:
 # File paths
 USER_DB_FILE = "users.json"
 
+EXPECTED_COLUMNS = [
+    "ID", "Student Name", "Class Category", "Class Section", "Month",
+    "Monthly Fee", "Annual Charges", "Admission Fee",
+    "Received Amount", "Payment Method", "Date", "Signature",
+    "Entry Timestamp", "Academic Year"
+]
+
+ALL_MONTHS = (
+    "APRIL", "MAY", "JUNE", "JULY", "AUGUST", "SEPTEMBER",
+    "OCTOBER", "NOVEMBER", "DECEMBER", "JANUARY", "FEBRUARY", "MARCH"
+)
+
+# Month choices on a fee record, including the one-off charges
+EDIT_MONTHS = ALL_MONTHS + ("ANNUAL", "ADMISSION")
+MONTH_INDEX = {month: i for i, month in enumerate(EDIT_MONTHS)}
+
+CLASS_CATEGORIES = [
+    "Nursery", "KGI", "KGII", 
+    "Class 1", "Class 2", "Class 3", "Class 4", "Class 5",
+    "Class 6", "Class 7", "Class 8", "Class 9", "Class 10 (Matric)"
+]
+
+CLASS_INDEX = {category: i for i, category in enumerate(CLASS_CATEGORIES)}
+
+PAYMENT_METHODS = ["Cash", "Bank Transfer", "Cheque", "Online Payment", "Other"]
+
+PAYMENT_INDEX = {method: i for i, method in enumerate(PAYMENT_METHODS)}
+
+CURRENCY_COLUMNS = ["Monthly Fee", "Annual Charges", "Admission Fee", "Received Amount"]
+
+# Styler renders cell by cell in Python; larger tables are shown unstyled
+STYLED_ROW_LIMIT = 200
+
+# Rows per page in View All Records
+PAGE_SIZE = 100
+
+# Column types for pyarrow's CSV reader, which ships with Streamlit
+FEES_ARROW_TYPES = {
+    "ID": pa.string(), "Student Name": pa.string(), "Class Category": pa.string(), "Class Section": pa.string(),
+    "Month": pa.string(), "Monthly Fee": pa.float64(), "Annual Charges": pa.float64(),
+    "Admission Fee": pa.float64(), "Received Amount": pa.float64(), "Payment Method": pa.string(),
+    "Date": pa.string(), "Signature": pa.string(), "Entry Timestamp": pa.string(), "Academic Year": pa.string()
+}
+FEES_CONVERT_OPTIONS = pa_csv.ConvertOptions(column_types=FEES_ARROW_TYPES, strings_can_be_null=True)
+FEES_PARSE_OPTIONS = pa_csv.ParseOptions(invalid_row_handler=lambda row: 'skip')
+
+# Low-cardinality text columns held as categoricals; known values first, anything else found in the file after
+FEES_CATEGORIES = {
+    "Class Category": CLASS_CATEGORIES,
+    "Month": EDIT_MONTHS,
+    "Payment Method": PAYMENT_METHODS,
+}
+
+EMAIL_PATTERN = re.compile(r'[a-zA-Z0-9._%+-]+@gmail\.com')
+
+# scrypt cost (n, r, p): ~16 MiB and tens of milliseconds per hash
+SCRYPT_PARAMS = (2**14, 8, 1)
+
+# New entries are saved ISO-style while edited rows are written back day-first
+DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y")
+TIMESTAMP_FORMATS = ("%Y-%m-%d %H:%M:%S", "%d-%m-%Y %H:%M")
+
 def get_admin_files(school_name):
     """Return file paths specific to the school"""
     if not school_name:
@@ -54,6 +133,51 @@ def get_admin_files(school_name):
         "student_fees_json": f"student_fees_{safe_school_name}.json"
     }
 
+def _json_loads(data):
+    """Parse JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _json_dumps(obj, indent=False):
+    """Serialize an object to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    return json.dumps(obj, indent=2 if indent else None).encode('utf-8')
+
+def _read_json(path):
+    """Read and parse a JSON file in one buffered read"""
+    with open(path, 'rb') as f:
+        return _json_loads(f.read())
+
+def _atomic_write_bytes(path, data):
+    """Write a file via a temp file and rename so readers never see a partial write"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        try:
+            f = os.fdopen(fd, 'wb', buffering=1 << 20)
+        except BaseException:
+            os.close(fd)
+            raise
+        with f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        # mkstemp creates the file 0600; keep the permissions of the file being replaced
+        try:
+            mode = stat.S_IMODE(os.stat(path).st_mode)
+        except FileNotFoundError:
+            mode = 0o644
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def _atomic_write_json(path, obj, indent=False):
+    """Serialize obj and replace the JSON file at path atomically"""
+    _atomic_write_bytes(path, _json_dumps(obj, indent=indent))
+
 def initialize_files():
     """Initialize all required files"""
     initialize_user_db()
@@ -62,9 +186,11 @@ def initialize_files():
 
 def initialize_user_db():
     """Initialize the user database if it doesn't exist"""
-    if not os.path.exists(USER_DB_FILE):
-        with open(USER_DB_FILE, 'w') as f:
-            json.dump({}, f)
+    try:
+        with open(USER_DB_FILE, 'xb') as f:
+            f.write(_json_dumps({}))
+    except FileExistsError:
+        pass
 
 def initialize_school_files():
     """Initialize school-specific files"""
@@ -77,57 +203,174 @@ def initialize_school_files():
     student_fees_file = files["student_fees_json"]
     csv_file = files["fees_csv"]
     
-    if not os.path.exists(student_fees_file):
-        with open(student_fees_file, 'w') as f:
-            json.dump({}, f)
+    try:
+        with open(student_fees_file, 'xb') as f:
+            f.write(_json_dumps({}))
+    except FileExistsError:
+        pass
     
-    if not os.path.exists(csv_file):
-        columns = [
-            "ID", "Student Name", "Class Category", "Class Section", "Month",
-            "Monthly Fee", "Annual Charges", "Admission Fee",
-            "Received Amount", "Payment Method", "Date", "Signature",
-            "Entry Timestamp", "Academic Year"
-        ]
-        pd.DataFrame(columns=columns).to_csv(csv_file, index=False)
-    else:
+    try:
+        with open(csv_file, 'x', newline='') as f:
+            pd.DataFrame(columns=EXPECTED_COLUMNS).to_csv(f, index=False)
+    except FileExistsError:
         try:
-            df = pd.read_csv(csv_file)
-            expected_columns = [
-                "ID", "Student Name", "Class Category", "Class Section", "Month",
-                "Monthly Fee", "Annual Charges", "Admission Fee",
-                "Received Amount", "Payment Method", "Date", "Signature",
-                "Entry Timestamp", "Academic Year"
-            ]
-            for col in expected_columns:
-                if col not in df.columns:
+            # Only the header is needed to tell whether the schema is current
+            missing = [col for col in EXPECTED_COLUMNS if col not in pd.read_csv(csv_file, nrows=0).columns]
+            if missing:
+                df = pd.read_csv(csv_file)
+                for col in missing:
                     df[col] = np.nan
-            df.to_csv(csv_file, index=False)
+                if "Academic Year" in missing:
+                    df['Academic Year'] = academic_year_vec(parse_dates(df['Date'].astype(str), DATE_FORMATS))
+                _atomic_write_bytes(csv_file, df.to_csv(index=False).encode('utf-8'))
         except Exception as e:
             st.error(f"Error initializing CSV: {str(e)}")
-            pd.DataFrame(columns=expected_columns).to_csv(csv_file, index=False)
+            pd.DataFrame(columns=EXPECTED_COLUMNS).to_csv(csv_file, index=False)
 
 
 def hash_password(password):
-    """Hash a password for storing"""
-    return sha256(password.encode('utf-8')).hexdigest()
+    """Hash a password for storing with a per-user salt (scrypt$n$r$p$salt$hash)"""
+    salt = os.urandom(16)
+    n, r, p = SCRYPT_PARAMS
+    digest = scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p)
+    return f"scrypt${n}${r}${p}${salt.hex()}${digest.hex()}"
+
+def is_legacy_hash(stored_password):
+    """Unsalted SHA-256 hashes from before the switch to scrypt"""
+    return not stored_password.startswith("scrypt$")
 
 def verify_password(stored_password, provided_password):
     """Verify a stored password against one provided by user"""
-    return stored_password == sha256(provided_password.encode('utf-8')).hexdigest()
+    if is_legacy_hash(stored_password):
+        return hmac.compare_digest(stored_password, sha256(provided_password.encode('utf-8')).hexdigest())
+    try:
+        _, n, r, p, salt, digest = stored_password.split('$')
+        computed = scrypt(provided_password.encode('utf-8'), salt=bytes.fromhex(salt), n=int(n), r=int(r), p=int(p))
+    except ValueError:
+        return False
+    return hmac.compare_digest(computed.hex(), digest)
 
 def validate_email(email):
     """Validate email format and ensure it's a Gmail address"""
-    email_pattern = r'^[a-zA-Z0-9._%+-]+@gmail\.com$'
-    return re.match(email_pattern, email) is not None
+    return email.endswith('@gmail.com') and EMAIL_PATTERN.fullmatch(email) is not None
+
+@st.cache_data(ttl=30, max_entries=1)
+def _load_users(mtime):
+    """Parse the user database; mtime is part of the cache key"""
+    return _read_json(USER_DB_FILE)
+
+@st.cache_resource
+def _user_db_writer():
+    """Background thread persisting users.json; bursts of saves are coalesced into one write of the latest snapshot"""
+    writer = {
+        # Wake-ups only; the snapshot to write is always the newest one in "pending"
+        "queue": queue.Queue(maxsize=16),
+        "pending": None,
+        "error": None,
+        "lock": threading.Lock(),
+        "write_lock": threading.Lock(),
+    }
+    
+    def flush():
+        with writer["write_lock"]:
+            with writer["lock"]:
+                users = writer["pending"]
+            if users is None:
+                return
+            try:
+                _atomic_write_json(USER_DB_FILE, users)
+            except Exception as e:
+                # Keep the snapshot pending so readers still see it; load_users reports the failure and retries
+                logging.getLogger(__name__).exception("Failed to write %s", USER_DB_FILE)
+                with writer["lock"]:
+                    writer["error"] = e
+                raise
+            with writer["lock"]:
+                writer["error"] = None
+                if writer["pending"] is users:
+                    writer["pending"] = None
+    
+    def run():
+        while True:
+            writer["queue"].get()
+            while True:
+                try:
+                    writer["queue"].get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                flush()
+            except Exception:
+                pass
+    
+    def wake():
+        try:
+            writer["queue"].put_nowait(None)
+        except queue.Full:
+            pass  # a flush is already due and will pick up the latest snapshot
+    
+    def flush_on_exit():
+        try:
+            flush()
+        except Exception:
+            pass
+    
+    writer["flush"] = flush
+    writer["wake"] = wake
+    threading.Thread(target=run, name="user-db-writer", daemon=True).start()
+    atexit.register(flush_on_exit)
+    return writer
+
+def save_users(users, wait=False):
+    """Queue the user database for writing; with wait=True write it now and raise if that fails"""
+    writer = _user_db_writer()
+    snapshot = copy.deepcopy(users)
+    with writer["lock"]:
+        previous = writer["pending"]
+        writer["pending"] = snapshot
+    if wait:
+        try:
+            writer["flush"]()
+        except Exception:
+            # The caller reports the failure, so readers shouldn't be served the unsaved change
+            with writer["lock"]:
+                if writer["pending"] is snapshot:
+                    writer["pending"] = previous
+            raise
+    else:
+        writer["wake"]()
+
+def load_users():
+    """Return the user database, re-reading it only when the file changes"""
+    writer = _user_db_writer()
+    with writer["lock"]:
+        pending = writer["pending"]
+        error = writer["error"]
+    if pending is not None:
+        if error is not None:
+            st.error(f"User changes could not be saved yet and will be lost on restart: {str(error)}")
+            writer["wake"]()
+        # A queued write hasn't landed yet; serve it so the change is visible immediately
+        return copy.deepcopy(pending)
+    
+    try:
+        mtime = os.path.getmtime(USER_DB_FILE)
+    except FileNotFoundError:
+        return {}
+    return _load_users(mtime)
 
 def authenticate_user(username, password):
     """Authenticate a user and check trial status"""
     try:
-        with open(USER_DB_FILE, 'r') as f:
-            users = json.load(f)
+        users = load_users()
         
         if username in users:
             if verify_password(users[username]['password'], password):
+                if is_legacy_hash(users[username]['password']):
+                    # Upgrade old unsalted hashes while the plaintext is at hand
+                    users[username]['password'] = hash_password(password)
+                    save_users(users)
+                
                 st.session_state.authenticated = True
                 st.session_state.current_user = username
                 st.session_state.is_admin = users[username].get('is_admin', False)
@@ -160,11 +403,7 @@ def authenticate_user(username, password):
 def create_user(username, password, email, school_name=None, is_admin=False, is_admin_owner=False):
     """Create a new user account with email, school name, and 1-month trial"""
     try:
-        if os.path.exists(USER_DB_FILE):
-            with open(USER_DB_FILE, 'r') as f:
-                users = json.load(f)
-        else:
-            users = {}
+        users = load_users()
         
         if not validate_email(email):
             return False, "Please use a valid Gmail address (e.g., username@gmail.com)"
@@ -192,8 +431,8 @@ def create_user(username, password, email, school_name=None, is_admin=False, is_
             "created_by": st.session_state.current_user if st.session_state.current_user else "system"
         }
         
-        with open(USER_DB_FILE, 'w') as f:
-            json.dump(users, f)
+        # New accounts are written before reporting success so a failed write isn't lost on restart
+        save_users(users, wait=True)
         
         if is_admin_owner and school_name:
             st.session_state.school_name = school_name
@@ -203,92 +442,188 @@ def create_user(username, password, email, school_name=None, is_admin=False, is_
     except Exception as e:
         return False, f"Error creating user: {str(e)}"
     
+@lru_cache(maxsize=1024)
 def generate_student_id(student_name, class_category):
     """Generate a unique 8-character ID based on student name and class"""
     unique_str = f"{student_name}_{class_category}".encode('utf-8')
     return md5(unique_str).hexdigest()[:8].upper()
 
 def save_to_csv(data):
-    """Save data to school-specific CSV with proper validation"""
+    """Append new records to the school-specific CSV without rewriting existing rows"""
     try:
         files = get_admin_files(st.session_state.school_name)
         csv_file = files["fees_csv"]
-        if os.path.exists(csv_file):
-            df = pd.read_csv(csv_file)
-        else:
-            df = pd.DataFrame(columns=data[0].keys())
+        try:
+            with open(csv_file, 'r', newline='') as f:
+                header = next(csv.reader(f), None)
+        except FileNotFoundError:
+            header = None
         
-        new_df = pd.DataFrame(data)
-        df = pd.concat([df, new_df], ignore_index=True)
+        # Follow the column order already on disk; older files may have appended columns
+        with open(csv_file, 'a', newline='', buffering=1 << 20) as f:
+            writer = csv.DictWriter(f, fieldnames=header or EXPECTED_COLUMNS,
+                                    extrasaction='ignore', lineterminator=os.linesep)
+            if not header:
+                writer.writeheader()
+            writer.writerows(data)
+            f.flush()
+            os.fsync(f.fileno())
         
-        df.to_csv(csv_file, index=False)
+        _load_data_cached.clear()
+        _id_index_cached.clear()
+        _student_index_cached.clear()
+        _student_summary_cached.clear()
         return True
     except Exception as e:
         st.error(f"Error saving data: {str(e)}")
         return False
 
+@lru_cache(maxsize=4096)
+def _parse_date(value):
+    """Parse one stored date string in either saved format; None if it matches neither"""
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+def parse_dates(values, formats):
+    """Parse date strings that may be in any of the given formats; unmatched values become NaT"""
+    parsed = pd.to_datetime(values, format=formats[0], errors='coerce')
+    for fmt in formats[1:]:
+        parsed = parsed.fillna(pd.to_datetime(values, format=fmt, errors='coerce'))
+    return parsed
+
+def _normalize_fees(df):
+    """Backfill missing columns, academic years and display date formats on freshly read rows"""
+    for col in EXPECTED_COLUMNS:
+        if col not in df.columns:
+            df[col] = np.nan
+    
+    dates = parse_dates(df['Date'], DATE_FORMATS)
+    df['Academic Year'] = df['Academic Year'].fillna(academic_year_vec(dates))
+    df['Date'] = dates.dt.strftime('%d-%m-%Y').fillna(df['Date'])
+    # Files from before the column existed have no timestamps; filling an all-null column only raises pandas' downcast warning
+    if df['Entry Timestamp'].notna().any():
+        df['Entry Timestamp'] = (parse_dates(df['Entry Timestamp'], TIMESTAMP_FORMATS)
+                                 .dt.strftime('%d-%m-%Y %H:%M').fillna(df['Entry Timestamp']))
+    
+    for col, known in FEES_CATEGORIES.items():
+        unknown = sorted(set(df[col].dropna()) - set(known))
+        # Months are ordered so sorts and comparisons follow the academic year, not the alphabet
+        df[col] = pd.Categorical(df[col], categories=list(known) + unknown, ordered=col == "Month")
+    
+    return df.dropna(how='all')
+
+@st.cache_resource(ttl=300, max_entries=8)
+def _load_data_cached(csv_file, mtime):
+    """Parse the fees CSV once for all sessions; mtime is part of the cache key so edits on disk invalidate it"""
+    if os.path.getsize(csv_file) == 0:
+        return pd.DataFrame()
+    
+    # Multithreaded C++ parser; malformed rows are skipped in the same pass
+    table = pa_csv.read_csv(csv_file, convert_options=FEES_CONVERT_OPTIONS, parse_options=FEES_PARSE_OPTIONS)
+    return _normalize_fees(table.to_pandas())
+
 def load_data():
-    """Load data from school-specific CSV with robust error handling"""
+    """Load data from school-specific CSV with robust error handling; the frame is shared, copy before mutating"""
     files = get_admin_files(st.session_state.school_name)
     csv_file = files["fees_csv"]
-    if not os.path.exists(csv_file):
+    try:
+        mtime = os.path.getmtime(csv_file)
+    except FileNotFoundError:
         return pd.DataFrame()
     
     try:
-        try:
-            df = pd.read_csv(csv_file)
-        except pd.errors.EmptyDataError:
-            return pd.DataFrame()
-        except pd.errors.ParserError:
-            df = pd.read_csv(csv_file, on_bad_lines='skip')
-        
-        expected_columns = [
-            "ID", "Student Name", "Class Category", "Class Section", "Month",
-            "Monthly Fee", "Annual Charges", "Admission Fee",
-            "Received Amount", "Payment Method", "Date", "Signature",
-            "Entry Timestamp", "Academic Year"
-        ]
-        
-        for col in expected_columns:
-            if col not in df.columns:
-                df[col] = np.nan
-        
-        try:
-            df['Date'] = pd.to_datetime(df['Date']).dt.strftime('%d-%m-%Y')
-        except:
-            pass
-        
-        try:
-            df['Entry Timestamp'] = pd.to_datetime(df['Entry Timestamp']).dt.strftime('%d-%m-%Y %H:%M')
-        except:
-            pass
-        
-        return df.dropna(how='all')
-    
+        return _load_data_cached(csv_file, mtime)
     except Exception as e:
         st.error(f"Error loading data: {str(e)}")
         return pd.DataFrame()
 
+@st.cache_resource(ttl=300, max_entries=8)
+def _student_index_cached(csv_file, mtime):
+    """Row positions per (class, student) and sorted student names per class for one file version"""
+    df = _load_data_cached(csv_file, mtime)
+    if df.empty:
+        return df, {}, {}
+    
+    rows = df.groupby(['Class Category', 'Student Name'], observed=True).indices
+    students_by_class = {}
+    for class_category, student_name in sorted(rows):
+        students_by_class.setdefault(class_category, []).append(student_name)
+    return df, rows, students_by_class
+
+def load_student_index():
+    """Return (df, rows, students_by_class) so per-student slices are df.iloc[rows[(class, name)]]"""
+    files = get_admin_files(st.session_state.school_name)
+    csv_file = files["fees_csv"]
+    try:
+        return _student_index_cached(csv_file, os.path.getmtime(csv_file))
+    except FileNotFoundError:
+        return pd.DataFrame(), {}, {}
+    except Exception as e:
+        st.error(f"Error loading data: {str(e)}")
+        return pd.DataFrame(), {}, {}
+
+@st.cache_resource(ttl=300, max_entries=8)
+def _id_index_cached(csv_file, mtime):
+    """Row positions per student ID for one file version, built from the shared parsed frame"""
+    df = _load_data_cached(csv_file, mtime)
+    if df.empty:
+        return df, {}
+    return df, df.groupby('ID', sort=False).indices
+
+def _student_records(csv_file, mtime, student_id):
+    """One student's fee records through the ID index instead of a mask over every row"""
+    df, id_rows = _id_index_cached(csv_file, mtime)
+    rows = id_rows.get(student_id)
+    if rows is None:
+        return pd.DataFrame(columns=EXPECTED_COLUMNS)
+    return df.iloc[rows]
+
+def load_student_records(student_id):
+    """Load one student's fee records from the cached file; the slice is a new frame"""
+    files = get_admin_files(st.session_state.school_name)
+    csv_file = files["fees_csv"]
+    try:
+        return _student_records(csv_file, os.path.getmtime(csv_file), student_id)
+    except FileNotFoundError:
+        return pd.DataFrame(columns=EXPECTED_COLUMNS)
+    except Exception as e:
+        st.error(f"Error loading data: {str(e)}")
+        return pd.DataFrame(columns=EXPECTED_COLUMNS)
+
 def update_data(updated_df):
     """Update the school-specific CSV file with the modified DataFrame"""
     try:
         files = get_admin_files(st.session_state.school_name)
         csv_file = files["fees_csv"]
-        updated_df.to_csv(csv_file, index=False)
+        _atomic_write_bytes(csv_file, updated_df.to_csv(index=False).encode('utf-8'))
+        _load_data_cached.clear()
+        _id_index_cached.clear()
+        _student_index_cached.clear()
+        _student_summary_cached.clear()
         return True
     except Exception as e:
         st.error(f"Error updating data: {str(e)}")
         return False
 
+@st.cache_resource(ttl=300, max_entries=8)
+def _load_student_fees_cached(student_fees_file, mtime):
+    """Parse the student fees JSON once for all sessions; mtime is part of the cache key"""
+    return _read_json(student_fees_file)
+
 def load_student_fees():
-    """Load student-specific fees from JSON file"""
+    """Load student-specific fees from JSON file; the dict is shared, copy before mutating"""
     try:
         files = get_admin_files(st.session_state.school_name)
         student_fees_file = files["student_fees_json"]
-        if os.path.exists(student_fees_file):
-            with open(student_fees_file, 'r') as f:
-                return json.load(f)
-        return {}
+        try:
+            mtime = os.path.getmtime(student_fees_file)
+        except FileNotFoundError:
+            return {}
+        return _load_student_fees_cached(student_fees_file, mtime)
     except Exception as e:
         st.error(f"Error loading student fees: {str(e)}")
         return {}
@@ -298,13 +633,18 @@ def save_student_fees(fees_data):
     try:
         files = get_admin_files(st.session_state.school_name)
         student_fees_file = files["student_fees_json"]
-        with open(student_fees_file, 'w') as f:
-            json.dump(fees_data, f, indent=4)
+        _atomic_write_json(student_fees_file, fees_data, indent=True)
+        _load_student_fees_cached.clear()
         return True
     except Exception as e:
         st.error(f"Error saving student fees: {str(e)}")
         return False
 
+@st.cache_data(max_entries=32, show_spinner=False)
+def _csv_bytes(df):
+    """Encode a frame for st.download_button; cached on the frame's content so reruns skip the encode"""
+    return df.to_csv(index=False).encode('utf-8')
+
 def format_currency(val):
     """Format currency with Pakistani Rupees symbol and thousand separators"""
     try:
@@ -312,54 +652,86 @@ def format_currency(val):
     except:
         return "Rs. 0"
 
-def style_row(row):
-    """Apply styling to DataFrame rows based on payment status"""
-    today = datetime.now()
-    is_between_1st_and_10th = 1 <= today.day <= 10
-    styles = [''] * len(row)
-    
-    if is_between_1st_and_10th:
-        if row['Monthly Fee'] == 0:
-            styles[0] = 'color: red'
-        else:
-            styles[0] = 'color: green'
+def format_currency_series(values):
+    """Vectorized format_currency for a whole column: truncate to whole rupees once, then format as text"""
+    rupees = pd.to_numeric(values, errors='coerce').fillna(0).astype('int64')
+    return pd.Series([f"Rs. {v:,}" for v in rupees.tolist()], index=values.index)
+
+def style_records(df):
+    """Colour the first column of fee records by payment status in one vectorized pass"""
+    styles = pd.DataFrame('', index=df.index, columns=df.columns)
+    if 1 <= datetime.now().day <= 10:
+        styles.iloc[:, 0] = np.where(df['Monthly Fee'] == 0, 'color: red', 'color: green')
     return styles
 
-def get_academic_year(date):
-    """Determine academic year based on date"""
-    year = date.year
-    if date.month >= 4:  # Academic year starts in April
+@st.cache_data(max_entries=64, show_spinner=False)
+def _format_records(df):
+    """Currency-formatted copy of fee records, cached on content so identical reruns reuse it"""
+    display = df.copy()
+    for col in CURRENCY_COLUMNS:
+        display[col] = format_currency_series(display[col])
+    return display
+
+def records_display(df):
+    """Fee records with currency pre-formatted as text; only frames up to STYLED_ROW_LIMIT rows get status colours"""
+    display = _format_records(df)
+    if len(df) > STYLED_ROW_LIMIT:
+        return display
+    return display.style.apply(lambda _: style_records(df), axis=None)
+
+@lru_cache(maxsize=512)
+def _academic_year(year, month):
+    """Academic year label for a calendar month; keyed on (year, month) so timestamps share entries"""
+    if month >= 4:  # Academic year starts in April
         return f"{year}-{year+1}"
     return f"{year-1}-{year}"
 
-def check_annual_admission_paid(student_id, academic_year):
-    """Check if annual charges or admission fee have been paid for the academic year"""
-    df = load_data()
-    if df.empty:
-        return False, False
+def get_academic_year(date):
+    """Determine academic year based on date"""
+    return _academic_year(date.year, date.month)
+
+def academic_year_vec(dates):
+    """Vectorized get_academic_year for a Series of datetimes; NaT gives NaN"""
+    start = dates.dt.year.where(dates.dt.month >= 4, dates.dt.year - 1).dropna().astype(int)
+    return (start.astype(str) + '-' + (start + 1).astype(str)).reindex(dates.index)
+
+@st.cache_data(ttl=60, max_entries=256, show_spinner=False)
+def _student_summary_cached(csv_file, mtime, student_id, academic_year):
+    """Derive a student's payment status from their fee records"""
+    df_student = _student_records(csv_file, mtime, student_id)
+    if df_student.empty:
+        return False, False, list(ALL_MONTHS)
+    
+    in_year = df_student['Academic Year'] == academic_year
+    annual_paid = df_student.loc[in_year, 'Annual Charges'].sum() > 0
+    admission_paid = df_student.loc[in_year, 'Admission Fee'].sum() > 0
+    paid = set(df_student.loc[df_student['Monthly Fee'] > 0, 'Month'].to_numpy().tolist())
     
-    student_records = df[(df['ID'] == student_id) & (df['Academic Year'] == academic_year)]
-    annual_paid = student_records['Annual Charges'].sum() > 0
-    admission_paid = student_records['Admission Fee'].sum() > 0
+    return bool(annual_paid), bool(admission_paid), [month for month in ALL_MONTHS if month not in paid]
+
+def get_student_summary(student_id, academic_year):
+    """Return (annual_paid, admission_paid, unpaid_months) for a student in one scan"""
+    files = get_admin_files(st.session_state.school_name)
+    csv_file = files["fees_csv"]
+    if student_id is None:
+        return False, False, list(ALL_MONTHS)
     
+    try:
+        return _student_summary_cached(csv_file, os.path.getmtime(csv_file), student_id, academic_year)
+    except FileNotFoundError:
+        return False, False, list(ALL_MONTHS)
+    except Exception as e:
+        st.error(f"Error loading data: {str(e)}")
+        return False, False, list(ALL_MONTHS)
+
+def check_annual_admission_paid(student_id, academic_year):
+    """Check if annual charges or admission fee have been paid for the academic year"""
+    annual_paid, admission_paid, _ = get_student_summary(student_id, academic_year)
     return annual_paid, admission_paid
 
 def get_unpaid_months(student_id):
     """Get list of unpaid months for a specific student"""
-    df = load_data()
-    all_months = [
-        "APRIL", "MAY", "JUNE", "JULY", "AUGUST", "SEPTEMBER",
-        "OCTOBER", "NOVEMBER", "DECEMBER", "JANUARY", "FEBRUARY", "MARCH"
-    ]
-    
-    if df.empty or student_id is None:
-        return all_months
-    
-    paid_months = df[(df['ID'] == student_id) & (df['Monthly Fee'] > 0)]['Month'].unique().tolist()
-    
-    unpaid_months = [month for month in all_months if month not in paid_months]
-    
-    return unpaid_months
+    return get_student_summary(student_id, get_academic_year(datetime.now()))[2]
 
 def update_student_data():
     """Update session state with student data when name or class changes"""
@@ -368,12 +740,28 @@ def update_student_data():
     
     if student_name and class_category:
         student_id = generate_student_id(student_name, class_category)
+        payment_date = st.session_state.get(f"payment_date_{st.session_state.form_key}", datetime.now())
+        _, _, unpaid_months = get_student_summary(student_id, get_academic_year(payment_date))
         st.session_state.current_student_id = student_id
-        st.session_state.available_months = get_unpaid_months(student_id)
+        st.session_state.available_months = unpaid_months
     else:
         st.session_state.current_student_id = None
         st.session_state.available_months = []
 
+def stored_choice(options, index, value):
+    """Selectbox options and index for a stored value; values outside the known choices are kept, not replaced"""
+    if value is None:
+        return options, None
+    if value in index:
+        return options, index[value]
+    return [*options, value], len(options)
+
+def rerun_fragment():
+    """Rerun only the calling fragment, or the whole app when the fragment is running as part of a full run"""
+    ctx = get_script_run_ctx()
+    # Fragment-scoped reruns are rejected while a full run (e.g. a pending menu change) is executing the fragment
+    st.rerun(scope="fragment" if ctx is not None and ctx.fragment_ids_this_run else "app")
+
 def format_trial_remaining(remaining):
     """Format remaining trial time"""
     if remaining is None:
@@ -383,132 +771,138 @@ def format_trial_remaining(remaining):
     minutes = (remaining.seconds % 3600) // 60
     return f"{days} days, {hours} hours, {minutes} minutes"
 
+HOME_PAGE_CSS = """
+<style>
+.main {
+    background-color: #f8f9fa;
+}
+.stApp {
+    background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
+}
+.title-text {
+    font-size: 3.5rem !important;
+    font-weight: 600 !important;
+    color: #2c3e50 !important;
+    text-align: center;
+    margin-bottom: 0.5rem !important;
+}
+.subtitle-text {
+    font-size: 1.5rem !important;
+    font-weight: 400 !important;
+    color: #7f8c8d !important;
+    text-align: center;
+    margin-bottom: 2rem !important;
+}
+.feature-card {
+    background-color: white;
+    border-radius: 10px;
+    padding: 1.5rem;
+    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+    transition: transform 0.3s ease;
+    height: 100%;
+}
+.feature-card:hover {
+    transform: translateY(-5px);
+    box-shadow: 0 10px 20px rgba(0, 0, 0, 0.1);
+}
+.feature-icon {
+    font-size: 2.5rem;
+    margin-bottom: 1rem;
+    color: #3498db;
+}
+.feature-title {
+    font-size: 1.2rem;
+    font-weight: 600;
+    margin-bottom: 0.5rem;
+    color: #2c3e50;
+}
+.feature-desc {
+    color: #7f8c8d;
+    font-size: 0.9rem;
+}
+.login-btn {
+    background: linear-gradient(135deg, #3498db 0%, #2c3e50 100%) !important;
+    color: white !important;
+    border: none !important;
+    padding: 0.5rem 1.5rem;
+    border-radius: 8px !important;
+    font-weight: 600 !important;
+    margin-top: 2rem !important;
+}
+.circle-container {
+    display: flex;
+    justify-content: center;
+    margin-bottom: 1rem;
+}
+.circle {
+    width: 200px;
+    height: 200px;
+    border-radius: 50%;
+    background-color: white;
+    box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
+    display: flex;
+    justify-content: center;
+    align-items: center;
+    overflow: hidden;
+}
+.circle img {
+    width: 100%;
+    height: 100%;
+    object-fit: cover;
+}
+.expander-content {
+    background-color: white;
+    border-radius: 10px;
+    padding: 2rem;
+    box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
+}
+.about-heading {
+    font-size: 2rem;
+    font-weight: 600;
+    color: #2c3e50;
+    margin-bottom: 1rem;
+    text-align: center;
+}
+.about-subheading {
+    font-size: 1.5rem;
+    font-weight: 500;
+    color: #3498db;
+    margin-top: 1.5rem;
+    margin-bottom: 1rem;
+}
+.about-text {
+    color: #7f8c8d;
+    font-size: 1rem;
+    line-height: 1.6;
+}
+.about-list {
+    color: #7f8c8d;
+    font-size: 1rem;
+    line-height: 1.6;
+    margin-left: 1rem;
+}
+</style>
+"""
+
+@st.cache_resource
+def _get_logo_html():
+    """Read and base64-encode the school logo once per server process"""
+    try:
+        with open("school.jpeg", "rb") as img_file:
+            img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
+        return f'<img src="data:image/jpeg;base64,{img_base64}" alt="School Logo">'
+    except:
+        return '<div style="color: gray; text-align: center; padding: 20px;">School Logo</div>'
+
+@st.fragment
 def home_page():
     """Display beautiful home page with logo and school name at the very top and about section in a dropdown"""
-    st.set_page_config(page_title="School Fees Management", layout="wide", page_icon="🏫")
-    
-    st.markdown("""
-    <style>
-    .main {
-        background-color: #f8f9fa;
-    }
-    .stApp {
-        background: linear-gradient(135deg, #f5f7fa 0%, #c3cfe2 100%);
-    }
-    .title-text {
-        font-size: 3.5rem !important;
-        font-weight: 600 !important;
-        color: #2c3e50 !important;
-        text-align: center;
-        margin-bottom: 0.5rem !important;
-    }
-    .subtitle-text {
-        font-size: 1.5rem !important;
-        font-weight: 400 !important;
-        color: #7f8c8d !important;
-        text-align: center;
-        margin-bottom: 2rem !important;
-    }
-    .feature-card {
-        background-color: white;
-        border-radius: 10px;
-        padding: 1.5rem;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-        transition: transform 0.3s ease;
-        height: 100%;
-    }
-    .feature-card:hover {
-        transform: translateY(-5px);
-        box-shadow: 0 10px 20px rgba(0, 0, 0, 0.1);
-    }
-    .feature-icon {
-        font-size: 2.5rem;
-        margin-bottom: 1rem;
-        color: #3498db;
-    }
-    .feature-title {
-        font-size: 1.2rem;
-        font-weight: 600;
-        margin-bottom: 0.5rem;
-        color: #2c3e50;
-    }
-    .feature-desc {
-        color: #7f8c8d;
-        font-size: 0.9rem;
-    }
-    .login-btn {
-        background: linear-gradient(135deg, #3498db 0%, #2c3e50 100%) !important;
-        color: white !important;
-        border: none !important;
-        padding: 0.5rem 1.5rem;
-        border-radius: 8px !important;
-        font-weight: 600 !important;
-        margin-top: 2rem !important;
-    }
-    .circle-container {
-        display: flex;
-        justify-content: center;
-        margin-bottom: 1rem;
-    }
-    .circle {
-        width: 200px;
-        height: 200px;
-        border-radius: 50%;
-        background-color: white;
-        box-shadow: 0 5px 15px rgba(0, 0, 0, 0.1);
-        display: flex;
-        justify-content: center;
-        align-items: center;
-        overflow: hidden;
-    }
-    .circle img {
-        width: 100%;
-        height: 100%;
-        object-fit: cover;
-    }
-    .expander-content {
-        background-color: white;
-        border-radius: 10px;
-        padding: 2rem;
-        box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-    }
-    .about-heading {
-        font-size: 2rem;
-        font-weight: 600;
-        color: #2c3e50;
-        margin-bottom: 1rem;
-        text-align: center;
-    }
-    .about-subheading {
-        font-size: 1.5rem;
-        font-weight: 500;
-        color: #3498db;
-        margin-top: 1.5rem;
-        margin-bottom: 1rem;
-    }
-    .about-text {
-        color: #7f8c8d;
-        font-size: 1rem;
-        line-height: 1.6;
-    }
-    .about-list {
-        color: #7f8c8d;
-        font-size: 1rem;
-        line-height: 1.6;
-        margin-left: 1rem;
-    }
-    </style>
-    """, unsafe_allow_html=True)
+    st.markdown(HOME_PAGE_CSS, unsafe_allow_html=True)
     
     # Logo at the very top
     st.markdown('<div class="circle-container">', unsafe_allow_html=True)
     
-    try:
-        with open("school.jpeg", "rb") as img_file:
-            img_base64 = base64.b64encode(img_file.read()).decode('utf-8')
-        img_html = f'<img src="data:image/jpeg;base64,{img_base64}" alt="School Logo">'
-    except:
-        img_html = '<div style="color: gray; text-align: center; padding: 20px;">School Logo</div>'
+    img_html = _get_logo_html()
     
     st.markdown(
         f"""
@@ -558,7 +952,7 @@ def home_page():
     st.markdown('<div style="text-align: center;">', unsafe_allow_html=True)
     if st.button("Sign Up for Free Trial / Login", key="home_login_btn", help="Click to sign up or login"):
         st.session_state.show_login = True
-        st.rerun()
+        st.rerun(scope="app")
     st.markdown('</div>', unsafe_allow_html=True)
     
     # About Section in Dropdown
@@ -681,6 +1075,7 @@ def home_page():
     </div>
     """, unsafe_allow_html=True)
 
+@st.fragment
 def login_page():
     """Display login page with signup option and handle authentication"""
     st.title("🔒 School Fees Management - Login / Sign Up")
@@ -700,9 +1095,10 @@ def login_page():
             is_admin = st.checkbox("Register as Admin Owner (Manage your school's fees)")
             
             show_password = st.checkbox("Show Password")
+            password_slot = st.empty()
             
             if show_password:
-                st.text(f"Password will be: {new_password if new_password else '[not set]'}")
+                password_slot.text(f"Password will be: {new_password if new_password else '[not set]'}")
             
             signup_submit = st.form_submit_button("Sign Up (Start 1-month Free Trial)") 
             
@@ -718,7 +1114,7 @@ def login_page():
                         st.success(f"{message} Your 1-month free trial has started!") 
                         st.info(f"User '{new_username}' created with email: {new_email}" + (f", School: {school_name}" if is_admin else ""))
                         if authenticate_user(new_username, new_password):
-                            st.rerun()
+                            st.rerun(scope="app")
                     else:
                         st.error(message)
 
@@ -731,10 +1127,11 @@ def login_page():
             if submit:
                 if authenticate_user(username, password):
                     st.success(f"Welcome {username}!")
-                    st.rerun()
+                    st.rerun(scope="app")
                 else:
                     st.error("Invalid username or password")
 
+@st.fragment
 def user_management():
     """Admin interface for user management, showing only users created by the current admin"""
     st.header("👥 User Management")
@@ -747,9 +1144,10 @@ def user_management():
             confirm_password = st.text_input("Confirm Password*", type="password", key="confirm_pass")
             is_admin = st.checkbox("Admin User (Sub-Admin)")
             show_password = st.checkbox("Show Password")
+            password_slot = st.empty()
             
             if show_password:
-                st.text(f"Password will be: {new_password if new_password else '[not set]'}")
+                password_slot.text(f"Password will be: {new_password if new_password else '[not set]'}")
             
             submit = st.form_submit_button("Create User")
             
@@ -765,32 +1163,38 @@ def user_management():
                         st.info(f"User '{new_username}' created with email: {new_email}, Trial: 1-month trial started")
                     else:
                         st.error(message)
+    
+    # Loaded after the create form so a user created in this run is listed right away
+    try:
+        users = load_users()
+    except Exception as e:
+        st.error(f"Error loading users: {str(e)}")
+        users = {}
+    current_user = st.session_state.current_user
+    owned_users = [username for username, details in users.items()
+                   if details.get('created_by') == current_user or username == current_user]
 
     with st.expander("👀 View All Users"):
         try:
-            with open(USER_DB_FILE, 'r') as f:
-                users = json.load(f)
-                
-            user_data = []
-            for username, details in users.items():
-                if details.get('created_by') == st.session_state.current_user or username == st.session_state.current_user:
-                    trial_remaining = "N/A"
-                    if details.get('trial_end'):
-                        trial_end = datetime.strptime(details['trial_end'], "%Y-%m-%d %H:%M:%S")
-                        remaining = trial_end - datetime.now()
-                        trial_remaining = format_trial_remaining(remaining) if remaining.total_seconds() > 0 else "Expired"
-                
-                    user_data.append({
-                        "Username": username,
-                        "Email": details.get('email', 'N/A'),
-                        "Role": "Admin Owner" if details.get('is_admin_owner', False) else ("Sub-Admin" if details.get('is_admin', False) else "User"),
-                        "School Name": details.get('school_name', 'N/A'),
-                        "Created At": details.get('created_at', "Unknown"),
-                        "Trial Remaining": trial_remaining,
-                        "Created By": details.get('created_by', 'system')
-                    })
+            details = pd.DataFrame.from_dict(users, orient='index').reindex(
+                index=owned_users,
+                columns=['email', 'is_admin_owner', 'is_admin', 'school_name', 'created_at', 'trial_end', 'created_by'])
+            
+            trial_end = pd.to_datetime(details['trial_end'], format="%Y-%m-%d %H:%M:%S", errors='coerce', cache=True)
+            remaining = trial_end - pd.Timestamp.now()
+            trial_remaining = (remaining[remaining > pd.Timedelta(0)].map(format_trial_remaining)
+                               .reindex(details.index).fillna("Expired").where(trial_end.notna(), "N/A"))
             
-            user_df = pd.DataFrame(user_data)
+            user_df = pd.DataFrame({
+                "Username": details.index,
+                "Email": details['email'].fillna('N/A').to_numpy(),
+                "Role": np.select([details['is_admin_owner'].eq(True), details['is_admin'].eq(True)],
+                                  ["Admin Owner", "Sub-Admin"], default="User"),
+                "School Name": details['school_name'].fillna('N/A').to_numpy(),
+                "Created At": details['created_at'].fillna("Unknown").to_numpy(),
+                "Trial Remaining": trial_remaining.to_numpy(),
+                "Created By": details['created_by'].fillna('system').to_numpy()
+            })
             if user_df.empty:
                 st.info("No users found created by you.")
             else:
@@ -808,16 +1212,12 @@ def user_management():
                         st.error("You cannot delete your own account!")
                     else:
                         try:
-                            with open(USER_DB_FILE, 'r') as f:
-                                users = json.load(f)
-                            
                             if user_to_delete in users and users[user_to_delete].get('is_admin_owner', False):
                                 st.error("Cannot delete Admin Owner account!")
                             elif user_to_delete in users:
                                 del users[user_to_delete]
                                 
-                                with open(USER_DB_FILE, 'w') as f:
-                                    json.dump(users, f)
+                                save_users(users)
                                 
                                 st.success(f"User '{user_to_delete}' deleted successfully!")
                                 st.rerun()
@@ -831,23 +1231,19 @@ def user_management():
 
     with st.expander("🔑 Reset Password"):
         try:
-            with open(USER_DB_FILE, 'r') as f:
-                users = json.load(f)
-            
-            users_list = [username for username, details in users.items() 
-                         if details.get('created_by') == st.session_state.current_user or username == st.session_state.current_user]
-            if not users_list:
+            if not owned_users:
                 st.info("No users found created by you.")
             else:
-                selected_user = st.selectbox("Select User", users_list, key="reset_user_select")
+                selected_user = st.selectbox("Select User", owned_users, key="reset_user_select")
                 
                 with st.form("reset_password_form"):
                     new_password = st.text_input("New Password*", type="password", key="reset_pass")
                     confirm_password = st.text_input("Confirm Password*", type="password", key="reset_confirm")
                     show_password = st.checkbox("Show New Password")
+                    password_slot = st.empty()
                     
                     if show_password:
-                        st.text(f"New password will be: {new_password if new_password else '[not set]'}")
+                        password_slot.text(f"New password will be: {new_password if new_password else '[not set]'}")
                     
                     reset_btn = st.form_submit_button("Reset Password")
                     
@@ -860,23 +1256,17 @@ def user_management():
                             st.error("Only Admin Owner can reset their own password!")
                         else:
                             users[selected_user]['password'] = hash_password(new_password)
-                            with open(USER_DB_FILE, 'w') as f:
-                                json.dump(users, f)
+                            save_users(users)
                             st.success(f"Password for {selected_user} reset successfully!")
                             st.info(f"New password: {new_password}")
         except Exception as e:
             st.error(f"Error resetting password: {str(e)}")
 
+@st.fragment
 def set_student_fees():
     """Admin interface to set fees for individual students"""
     st.header("💸 Set Student Fees")
     
-    CLASS_CATEGORIES = [
-        "Nursery", "KGI", "KGII", 
-        "Class 1", "Class 2", "Class 3", "Class 4", "Class 5",
-        "Class 6", "Class 7", "Class 8", "Class 9", "Class 10 (Matric)"
-    ]
-    
     with st.expander("➕ Set Fees for a Student"):
         with st.form("set_fees_form"):
             col1, col2 = st.columns(2)
@@ -896,7 +1286,7 @@ def set_student_fees():
                     st.error("Please fill all required fields (*)")
                 else:
                     student_id = generate_student_id(student_name, class_category)
-                    fees_data = load_student_fees()
+                    fees_data = dict(load_student_fees())
                     
                     fees_data[student_id] = {
                         "student_name": student_name,
@@ -909,7 +1299,7 @@ def set_student_fees():
                     
                     if save_student_fees(fees_data):
                         st.success(f"Fee settings saved for {student_name} ({class_category})")
-                        st.rerun()
+                        rerun_fragment()
                     else:
                         st.error("Failed to save fee settings")
 
@@ -919,18 +1309,20 @@ def set_student_fees():
             st.info("No student fees settings found")
         else:
             fee_records = [
-                {
-                    "Student ID": student_id,
-                    "Student Name": details["student_name"],
-                    "Class": details["class_category"],
-                    "Monthly Fee": format_currency(details["monthly_fee"]),
-                    "Annual Charges": format_currency(details["annual_charges"]),
-                    "Admission Fee": format_currency(details["admission_fee"]),
-                    "Updated At": details["updated_at"]
-                }
+                (
+                    student_id,
+                    details["student_name"],
+                    details["class_category"],
+                    format_currency(details["monthly_fee"]),
+                    format_currency(details["annual_charges"]),
+                    format_currency(details["admission_fee"]),
+                    details["updated_at"]
+                )
                 for student_id, details in fees_data.items()
             ]
-            fee_df = pd.DataFrame(fee_records)
+            fee_df = pd.DataFrame(fee_records, columns=[
+                "Student ID", "Student Name", "Class", "Monthly Fee", "Annual Charges", "Admission Fee", "Updated At"
+            ])
             st.dataframe(fee_df, use_container_width=True)
             
             st.subheader("Edit/Delete Fee Settings")
@@ -947,8 +1339,8 @@ def set_student_fees():
                     with col1:
                         edit_name = st.text_input("Student Name*", value=student_details["student_name"])
                     with col2:
-                        edit_class = st.selectbox("Class Category*", CLASS_CATEGORIES, 
-                                                 index=CLASS_CATEGORIES.index(student_details["class_category"]))
+                        class_options, class_index = stored_choice(CLASS_CATEGORIES, CLASS_INDEX, student_details["class_category"])
+                        edit_class = st.selectbox("Class Category*", class_options, index=class_index)
                     
                     edit_monthly_fee = st.number_input("Monthly Fee*", min_value=0, 
                                                       value=int(student_details["monthly_fee"]), step=100)
@@ -968,7 +1360,7 @@ def set_student_fees():
                             st.error("Please fill all required fields (*)")
                         else:
                             new_student_id = generate_student_id(edit_name, edit_class)
-                            fees_data = load_student_fees()
+                            fees_data = dict(load_student_fees())
                             
                             if new_student_id != student_to_edit:
                                 fees_data.pop(student_to_edit, None)
@@ -984,23 +1376,306 @@ def set_student_fees():
                             
                             if save_student_fees(fees_data):
                                 st.success(f"Fee settings updated for {edit_name} ({edit_class})")
-                                st.rerun()
+                                rerun_fragment()
                             else:
                                 st.error("Failed to update fee settings")
                     
                     if delete_btn:
-                        fees_data = load_student_fees()
+                        fees_data = dict(load_student_fees())
                         if student_to_edit in fees_data:
                             del fees_data[student_to_edit]
                             if save_student_fees(fees_data):
                                 st.success("Fee settings deleted successfully")
-                                st.rerun()
+                                rerun_fragment()
                             else:
                                 st.error("Failed to delete fee settings")
 
+@st.fragment
+def enter_fees_fragment():
+    """Fee entry form and the student's payment history; interactions rerun only this section"""
+    st.header("➕ Enter Fee Details")
+    
+    with st.form(key=f"fee_form_{st.session_state.form_key}", clear_on_submit=False):
+        col1, col2 = st.columns(2)
+        with col1:
+            student_name = st.text_input(
+                "Student Name*", 
+                placeholder="Full name", 
+                value=st.session_state.last_student_name,
+                key=f"student_name_{st.session_state.form_key}"
+            )
+        with col2:
+            class_category = st.selectbox(
+                "Class Category*", 
+                CLASS_CATEGORIES, 
+                index=CLASS_INDEX.get(st.session_state.last_class_category, 0),
+                key=f"class_category_{st.session_state.form_key}"
+            )
+            class_section = st.text_input(
+                "Class Section", 
+                placeholder="A, B, etc. (if applicable)", 
+                value=st.session_state.last_class_section,
+                key=f"class_section_{st.session_state.form_key}"
+            )
+        
+        update_btn = st.form_submit_button("🔍 Check Student Records")
+        
+        if update_btn:
+            # Nothing above reads the student state, so the rest of this run already sees the update
+            update_student_data()
+        
+        student_id = st.session_state.current_student_id
+        
+        if student_id:
+            st.subheader("📋 Student Payment History")
+            student_records = load_student_records(student_id)
+            
+            if not student_records.empty:
+                display_df = student_records[[
+                    "Student Name", "Month", "Monthly Fee", "Annual Charges", 
+                    "Admission Fee", "Received Amount", "Payment Method", "Date", "Academic Year"
+                ]].sort_values("Date", ascending=False)
+                for col in CURRENCY_COLUMNS:
+                    display_df[col] = format_currency_series(display_df[col])
+                
+                st.dataframe(display_df, use_container_width=True)
+                
+                total_monthly, total_annual, total_admission, total_received = student_records[CURRENCY_COLUMNS].sum()
+                
+                with st.container():
+                    col1, col2, col3, col4 = st.columns(4)
+                    col1.metric("Total Monthly", format_currency(total_monthly))
+                    col2.metric("Total Annual", format_currency(total_annual))
+                    col3.metric("Total Admission", format_currency(total_admission))
+                    col4.metric("Total Received", format_currency(total_received))
+                
+                st.subheader("Payment Status")
+                payment_date = st.session_state.get(f"payment_date_{st.session_state.form_key}", datetime.now())
+                academic_year = get_academic_year(payment_date)
+                
+                annual_paid, admission_paid = check_annual_admission_paid(student_id, academic_year)
+                unpaid_months = st.session_state.available_months
+                
+                col_paid, col_unpaid = st.columns(2)
+                
+                with col_paid:
+                    st.markdown("#### ✅ Paid Months")
+                    paid_df = (student_records.loc[student_records['Monthly Fee'] > 0, ['Month', 'Monthly Fee']]
+                               .drop_duplicates('Month').sort_values('Month'))
+                    if not paid_df.empty:
+                        paid_df['Monthly Fee'] = format_currency_series(paid_df['Monthly Fee'])
+                        st.dataframe(paid_df, hide_index=True, use_container_width=True)
+                    else:
+                        st.markdown("No months paid yet")
+                
+                with col_unpaid:
+                    st.markdown("#### ❌ Unpaid Months")
+                    if len(unpaid_months) > 0:
+                        st.dataframe(pd.DataFrame({'Month': unpaid_months}), hide_index=True, use_container_width=True)
+                    else:
+                        st.markdown("All months paid")
+                
+                st.markdown("---")
+                st.markdown(f"**Annual Fees Paid**: {'✅ Yes' if annual_paid else '❌ No'}")
+                st.markdown(f"**Admission Fee Paid**: {'✅ Yes' if admission_paid else '❌ No'}")
+            else:
+                st.info("No fee records found for this student.")
+                unpaid_months = st.session_state.available_months
+                
+                st.markdown("#### ❌ Unpaid Months")
+                if len(unpaid_months) > 0:
+                    st.dataframe(pd.DataFrame({'Month': unpaid_months}), hide_index=True, use_container_width=True)
+                else:
+                    st.markdown("All months paid")
+        
+        payment_date = st.date_input("Payment Date", value=datetime.now(), 
+                                   key=f"payment_date_{st.session_state.form_key}")
+        academic_year = get_academic_year(payment_date)
+        
+        fee_type = st.radio("Select Fee Type*", 
+                          ["Monthly Fee", "Annual Charges", "Admission Fee"],
+                          horizontal=True,
+                          key=f"fee_type_{st.session_state.form_key}")
+        
+        selected_months = []
+        monthly_fee = 0
+        annual_charges = 0
+        admission_fee = 0
+        
+        predefined_fees = load_student_fees().get(student_id, {}) if student_id else {}
+        default_monthly_fee = predefined_fees.get("monthly_fee", 2000)
+        default_annual_charges = predefined_fees.get("annual_charges", 5000)
+        default_admission_fee = predefined_fees.get("admission_fee", 1000)
+        
+        if fee_type == "Monthly Fee":
+            if not student_id:
+                st.warning("Please enter Student Name and select Class Category.")
+            elif not st.session_state.available_months:
+                st.error("All months have been paid for this student!")
+            else:
+                monthly_fee = st.number_input(
+                    "Monthly Fee Amount per Month*",
+                    min_value=0,
+                    value=default_monthly_fee,
+                    disabled=bool(predefined_fees) and not st.session_state.is_admin,
+                    key=f"monthly_fee_{st.session_state.form_key}"
+                )
+                selected_month = st.selectbox(
+                    "Select Month*",
+                    ["Select a month"] + st.session_state.available_months,
+                    key=f"month_select_{st.session_state.form_key}"
+                )
+                if selected_month != "Select a month":
+                    selected_months = [selected_month]
+                    st.markdown(f"**Selected Month**: {selected_month}")
+                else:
+                    st.markdown("**Selected Month**: None")
+        
+        elif fee_type == "Annual Charges":
+            if student_id:
+                annual_paid, _ = check_annual_admission_paid(student_id, academic_year)
+                if annual_paid:
+                    st.error("Annual charges have already been paid for this academic year!")
+                else:
+                    selected_months = ["ANNUAL"]
+                    annual_charges = st.number_input(
+                        "Annual Charges Amount*",
+                        min_value=0,
+                        value=default_annual_charges,
+                        disabled=bool(predefined_fees) and not st.session_state.is_admin,
+                        key=f"annual_charges_{st.session_state.form_key}"
+                    )
+            else:
+                st.warning("Please enter Student Name and select Class Category.")
+        
+        elif fee_type == "Admission Fee":
+            if student_id:
+                _, admission_paid = check_annual_admission_paid(student_id, academic_year)
+                if admission_paid:
+                    st.error("Admission fee has already been paid for this academic year!")
+                else:
+                    selected_months = ["ADMISSION"]
+                    admission_fee = st.number_input(
+                        "Admission Fee Amount*",
+                        min_value=0,
+                        value=default_admission_fee,
+                        disabled=bool(predefined_fees) and not st.session_state.is_admin,
+                        key=f"admission_fee_{st.session_state.form_key}"
+                    )
+            else:
+                st.warning("Please enter Student Name and select Class Category.")
+        
+        col3, col4 = st.columns(2)
+        with col3:
+            total_amount = (monthly_fee * len(selected_months)) + annual_charges + admission_fee
+            st.text_input(
+                "Total Amount",
+                value=format_currency(total_amount),
+                disabled=True,
+                key=f"total_amount_{st.session_state.form_key}"
+            )
+            
+            payment_method = st.selectbox(
+                "Payment Method*",
+                PAYMENT_METHODS,
+                key=f"payment_method_{st.session_state.form_key}"
+            )
+        with col4:
+            received_amount = st.number_input(
+                "Received Amount*",
+                min_value=0,
+                value=total_amount,
+                key=f"received_amount_{st.session_state.form_key}"
+            )
+            
+            signature = st.text_input(
+                "Received By (Signature)*",
+                placeholder="Your name",
+                key=f"signature_{st.session_state.form_key}"
+            )
+        
+        col_btn1, col_btn2 = st.columns(2)
+        with col_btn1:
+            submitted = st.form_submit_button("💾 Save Fee Record")
+        with col_btn2:
+            refresh = st.form_submit_button("🔄 Refresh Form")
+        
+        if refresh:
+            st.session_state.form_key += 1
+            st.session_state.last_student_name = ""
+            st.session_state.last_class_category = None
+            st.session_state.last_class_section = ""
+            st.session_state.current_student_id = None
+            st.session_state.available_months = []
+            rerun_fragment()
+        
+        if submitted:
+            if not student_name or not class_category or not signature:
+                st.error("Please fill all required fields (*)")
+            elif not student_id:
+                st.error("Please enter Student Name and select Class Category.")
+            elif fee_type == "Monthly Fee" and not selected_months:
+                st.error("Please select a month for Monthly Fee payment.")
+            elif fee_type == "Annual Charges" and annual_paid:
+                st.error("Annual charges have already been paid for this academic year!")
+            elif fee_type == "Admission Fee" and admission_paid:
+                st.error("Admission fee has already been paid for this academic year!")
+            else:
+                base = {
+                    "ID": student_id,
+                    "Student Name": student_name,
+                    "Class Category": class_category,
+                    "Class Section": class_section,
+                    "Monthly Fee": 0,
+                    "Annual Charges": 0,
+                    "Admission Fee": 0,
+                    "Payment Method": payment_method,
+                    "Date": payment_date.strftime("%Y-%m-%d"),
+                    "Signature": signature,
+                    "Entry Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "Academic Year": academic_year
+                }
+                
+                if fee_type in ["Annual Charges", "Admission Fee"]:
+                    fee_records = [{
+                        **base,
+                        "Month": selected_months[0],
+                        "Annual Charges": annual_charges,
+                        "Admission Fee": admission_fee,
+                        "Received Amount": received_amount
+                    }]
+                else:
+                    fee_records = [
+                        {**base, "Month": month, "Monthly Fee": monthly_fee, "Received Amount": monthly_fee}
+                        for month in selected_months
+                    ]
+                
+                if save_to_csv(fee_records):
+                    st.session_state.last_student_name = student_name
+                    st.session_state.last_class_category = class_category
+                    st.session_state.last_class_section = class_section or ""
+                    
+                    st.session_state.form_key += 1
+                    st.session_state.available_months = get_unpaid_months(student_id)
+                    st.session_state.last_saved_records = fee_records
+                    st.success("✅ Fee record(s) saved successfully!")
+                    st.balloons()
+                    rerun_fragment()
+        
+        if st.session_state.last_saved_records:
+            st.subheader("📋 Last Saved Fee Record(s)")
+            saved_df = pd.DataFrame(st.session_state.last_saved_records)
+            display_df = saved_df[[
+                "Student Name", "Class Category", "Month", "Monthly Fee", 
+                "Annual Charges", "Admission Fee", "Received Amount", 
+                "Payment Method", "Date", "Signature"
+            ]].copy()
+            for col in CURRENCY_COLUMNS:
+                display_df[col] = format_currency_series(display_df[col])
+            st.dataframe(display_df, use_container_width=True)
+
 def main_app():
     """Main application after login"""
-    st.set_page_config(page_title="School Fees Management", layout="wide")
     st.title(f"📚 {st.session_state.school_name or 'School'} Fees Management System")
     
     # Display trial status in sidebar
@@ -1048,325 +1723,8 @@ def main_app():
         st.session_state.trial_remaining = None
         st.rerun()
     
-    CLASS_CATEGORIES = [
-        "Nursery", "KGI", "KGII", 
-        "Class 1", "Class 2", "Class 3", "Class 4", "Class 5",
-        "Class 6", "Class 7", "Class 8", "Class 9", "Class 10 (Matric)"
-    ]
-    
-    PAYMENT_METHODS = ["Cash", "Bank Transfer", "Cheque", "Online Payment", "Other"]
-    
     if menu == "Enter Fees":
-        st.header("➕ Enter Fee Details")
-        
-        with st.form(key=f"fee_form_{st.session_state.form_key}", clear_on_submit=False):
-            col1, col2 = st.columns(2)
-            with col1:
-                student_name = st.text_input(
-                    "Student Name*", 
-                    placeholder="Full name", 
-                    value=st.session_state.last_student_name,
-                    key=f"student_name_{st.session_state.form_key}"
-                )
-            with col2:
-                class_category = st.selectbox(
-                    "Class Category*", 
-                    CLASS_CATEGORIES, 
-                    index=CLASS_CATEGORIES.index(st.session_state.last_class_category) if st.session_state.last_class_category in CLASS_CATEGORIES else 0,
-                    key=f"class_category_{st.session_state.form_key}"
-                )
-                class_section = st.text_input(
-                    "Class Section", 
-                    placeholder="A, B, etc. (if applicable)", 
-                    value=st.session_state.last_class_section,
-                    key=f"class_section_{st.session_state.form_key}"
-                )
-            
-            update_btn = st.form_submit_button("🔍 Check Student Records")
-            
-            if update_btn:
-                update_student_data()
-                st.rerun()
-            
-            student_id = st.session_state.current_student_id
-            
-            if student_id:
-                st.subheader("📋 Student Payment History")
-                df = load_data()
-                student_records = df[df['ID'] == student_id]
-                
-                if not student_records.empty:
-                    display_df = student_records[[
-                        "Student Name", "Month", "Monthly Fee", "Annual Charges", 
-                        "Admission Fee", "Received Amount", "Payment Method", "Date", "Academic Year"
-                    ]].sort_values("Date", ascending=False)
-                    
-                    st.dataframe(
-                        display_df.style.format({
-                            "Monthly Fee": format_currency,
-                            "Annual Charges": format_currency,
-                            "Admission Fee": format_currency,
-                            "Received Amount": format_currency
-                        }),
-                        use_container_width=True
-                    )
-                    
-                    total_monthly = student_records["Monthly Fee"].sum()
-                    total_annual = student_records["Annual Charges"].sum()
-                    total_admission = student_records["Admission Fee"].sum()
-                    total_received = student_records["Received Amount"].sum()
-                    
-                    col1, col2, col3, col4 = st.columns(4)
-                    col1.metric("Total Monthly", format_currency(total_monthly))
-                    col2.metric("Total Annual", format_currency(total_annual))
-                    col3.metric("Total Admission", format_currency(total_admission))
-                    col4.metric("Total Received", format_currency(total_received))
-                    
-                    st.subheader("Payment Status")
-                    payment_date = st.session_state.get(f"payment_date_{st.session_state.form_key}", datetime.now())
-                    academic_year = get_academic_year(payment_date)
-                    
-                    annual_paid, admission_paid = check_annual_admission_paid(student_id, academic_year)
-                    unpaid_months = st.session_state.available_months
-                    
-                    col_paid, col_unpaid = st.columns(2)
-                    
-                    with col_paid:
-                        st.markdown("#### ✅ Paid Months")
-                        paid_months = student_records[student_records['Monthly Fee'] > 0]['Month'].unique()
-                        if len(paid_months) > 0:
-                            for month in sorted(paid_months):
-                                amount = student_records[student_records['Month'] == month]['Monthly Fee'].iloc[0]
-                                st.markdown(f"- {month}: {format_currency(amount)}")
-                        else:
-                            st.markdown("No months paid yet")
-                    
-                    with col_unpaid:
-                        st.markdown("#### ❌ Unpaid Months")
-                        if len(unpaid_months) > 0:
-                            for month in unpaid_months:
-                                st.markdown(f"- {month}")
-                        else:
-                            st.markdown("All months paid")
-                    
-                    st.markdown("---")
-                    st.markdown(f"**Annual Fees Paid**: {'✅ Yes' if annual_paid else '❌ No'}")
-                    st.markdown(f"**Admission Fee Paid**: {'✅ Yes' if admission_paid else '❌ No'}")
-                else:
-                    st.info("No fee records found for this student.")
-                    unpaid_months = st.session_state.available_months
-                    
-                    st.markdown("#### ❌ Unpaid Months")
-                    if len(unpaid_months) > 0:
-                        for month in unpaid_months:
-                            st.markdown(f"- {month}")
-                    else:
-                        st.markdown("All months paid")
-            
-            payment_date = st.date_input("Payment Date", value=datetime.now(), 
-                                       key=f"payment_date_{st.session_state.form_key}")
-            academic_year = get_academic_year(payment_date)
-            
-            fee_type = st.radio("Select Fee Type*", 
-                              ["Monthly Fee", "Annual Charges", "Admission Fee"],
-                              horizontal=True,
-                              key=f"fee_type_{st.session_state.form_key}")
-            
-            selected_months = []
-            monthly_fee = 0
-            annual_charges = 0
-            admission_fee = 0
-            
-            fees_data = load_student_fees()
-            predefined_fees = fees_data.get(student_id, {})
-            default_monthly_fee = predefined_fees.get("monthly_fee", 2000)
-            default_annual_charges = predefined_fees.get("annual_charges", 5000)
-            default_admission_fee = predefined_fees.get("admission_fee", 1000)
-            
-            if fee_type == "Monthly Fee":
-                if not student_id:
-                    st.warning("Please enter Student Name and select Class Category.")
-                elif not st.session_state.available_months:
-                    st.error("All months have been paid for this student!")
-                else:
-                    monthly_fee = st.number_input(
-                        "Monthly Fee Amount per Month*",
-                        min_value=0,
-                        value=default_monthly_fee,
-                        disabled=bool(predefined_fees) and not st.session_state.is_admin,
-                        key=f"monthly_fee_{st.session_state.form_key}"
-                    )
-                    selected_month = st.selectbox(
-                        "Select Month*",
-                        ["Select a month"] + st.session_state.available_months,
-                        key=f"month_select_{st.session_state.form_key}"
-                    )
-                    if selected_month != "Select a month":
-                        selected_months = [selected_month]
-                        st.markdown(f"**Selected Month**: {selected_month}")
-                    else:
-                        st.markdown("**Selected Month**: None")
-            
-            elif fee_type == "Annual Charges":
-                if student_id:
-                    annual_paid, _ = check_annual_admission_paid(student_id, academic_year)
-                    if annual_paid:
-                        st.error("Annual charges have already been paid for this academic year!")
-                    else:
-                        selected_months = ["ANNUAL"]
-                        annual_charges = st.number_input(
-                            "Annual Charges Amount*",
-                            min_value=0,
-                            value=default_annual_charges,
-                            disabled=bool(predefined_fees) and not st.session_state.is_admin,
-                            key=f"annual_charges_{st.session_state.form_key}"
-                        )
-                else:
-                    st.warning("Please enter Student Name and select Class Category.")
-            
-            elif fee_type == "Admission Fee":
-                if student_id:
-                    _, admission_paid = check_annual_admission_paid(student_id, academic_year)
-                    if admission_paid:
-                        st.error("Admission fee has already been paid for this academic year!")
-                    else:
-                        selected_months = ["ADMISSION"]
-                        admission_fee = st.number_input(
-                            "Admission Fee Amount*",
-                            min_value=0,
-                            value=default_admission_fee,
-                            disabled=bool(predefined_fees) and not st.session_state.is_admin,
-                            key=f"admission_fee_{st.session_state.form_key}"
-                        )
-                else:
-                    st.warning("Please enter Student Name and select Class Category.")
-            
-            col3, col4 = st.columns(2)
-            with col3:
-                total_amount = (monthly_fee * len(selected_months)) + annual_charges + admission_fee
-                st.text_input(
-                    "Total Amount",
-                    value=format_currency(total_amount),
-                    disabled=True,
-                    key=f"total_amount_{st.session_state.form_key}"
-                )
-                
-                payment_method = st.selectbox(
-                    "Payment Method*",
-                    PAYMENT_METHODS,
-                    key=f"payment_method_{st.session_state.form_key}"
-                )
-            with col4:
-                received_amount = st.number_input(
-                    "Received Amount*",
-                    min_value=0,
-                    value=total_amount,
-                    key=f"received_amount_{st.session_state.form_key}"
-                )
-                
-                signature = st.text_input(
-                    "Received By (Signature)*",
-                    placeholder="Your name",
-                    key=f"signature_{st.session_state.form_key}"
-                )
-            
-            col_btn1, col_btn2 = st.columns(2)
-            with col_btn1:
-                submitted = st.form_submit_button("💾 Save Fee Record")
-            with col_btn2:
-                refresh = st.form_submit_button("🔄 Refresh Form")
-            
-            if refresh:
-                st.session_state.form_key += 1
-                st.session_state.last_student_name = ""
-                st.session_state.last_class_category = None
-                st.session_state.last_class_section = ""
-                st.session_state.current_student_id = None
-                st.session_state.available_months = []
-                st.rerun()
-            
-            if submitted:
-                if not student_name or not class_category or not signature:
-                    st.error("Please fill all required fields (*)")
-                elif not student_id:
-                    st.error("Please enter Student Name and select Class Category.")
-                elif fee_type == "Monthly Fee" and not selected_months:
-                    st.error("Please select a month for Monthly Fee payment.")
-                elif fee_type == "Annual Charges" and annual_paid:
-                    st.error("Annual charges have already been paid for this academic year!")
-                elif fee_type == "Admission Fee" and admission_paid:
-                    st.error("Admission fee has already been paid for this academic year!")
-                else:
-                    fee_records = []
-                    
-                    if fee_type in ["Annual Charges", "Admission Fee"]:
-                        fee_data = {
-                            "ID": student_id,
-                            "Student Name": student_name,
-                            "Class Category": class_category,
-                            "Class Section": class_section,
-                            "Month": selected_months[0],
-                            "Monthly Fee": 0,
-                            "Annual Charges": annual_charges,
-                            "Admission Fee": admission_fee,
-                            "Received Amount": received_amount,
-                            "Payment Method": payment_method,
-                            "Date": payment_date.strftime("%Y-%m-%d"),
-                            "Signature": signature,
-                            "Entry Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                            "Academic Year": academic_year
-                        }
-                        fee_records.append(fee_data)
-                    
-                    elif fee_type == "Monthly Fee":
-                        for month in selected_months:
-                            fee_data = {
-                                "ID": student_id,
-                                "Student Name": student_name,
-                                "Class Category": class_category,
-                                "Class Section": class_section,
-                                "Month": month,
-                                "Monthly Fee": monthly_fee,
-                                "Annual Charges": 0,
-                                "Admission Fee": 0,
-                                "Received Amount": monthly_fee,
-                                "Payment Method": payment_method,
-                                "Date": payment_date.strftime("%Y-%m-%d"),
-                                "Signature": signature,
-                                "Entry Timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                                "Academic Year": academic_year
-                            }
-                            fee_records.append(fee_data)
-                    
-                    if save_to_csv(fee_records):
-                        st.session_state.last_student_name = student_name
-                        st.session_state.last_class_category = class_category
-                        st.session_state.last_class_section = class_section or ""
-                        
-                        st.session_state.form_key += 1
-                        st.session_state.available_months = get_unpaid_months(student_id)
-                        st.session_state.last_saved_records = fee_records
-                        st.success("✅ Fee record(s) saved successfully!")
-                        st.balloons()
-                        st.rerun()
-            
-            if st.session_state.last_saved_records:
-                st.subheader("📋 Last Saved Fee Record(s)")
-                saved_df = pd.DataFrame(st.session_state.last_saved_records)
-                display_df = saved_df[[
-                    "Student Name", "Class Category", "Month", "Monthly Fee", 
-                    "Annual Charges", "Admission Fee", "Received Amount", 
-                    "Payment Method", "Date", "Signature"
-                ]]
-                st.dataframe(
-                    display_df.style.format({
-                        "Monthly Fee": format_currency,
-                        "Annual Charges": format_currency,
-                        "Admission Fee": format_currency,
-                        "Received Amount": format_currency
-                    }),
-                    use_container_width=True
-                )
+        enter_fees_fragment()
     
     elif menu == "Set Student Fees":
         if not st.session_state.is_admin:
@@ -1404,43 +1762,31 @@ def main_app():
                             )
                             
                             with st.form("edit_form"):
-                                record = df.loc[edit_index]
+                                # Plain dict with missing values as None, so fields can default with `or`
+                                record = {col: None if pd.isna(value) else value for col, value in df.loc[edit_index].items()}
                                 
                                 col1, col2 = st.columns(2)
                                 with col1:
                                     edit_name = st.text_input("Student Name", value=record['Student Name'])
-                                    edit_class = st.selectbox("Class Category", CLASS_CATEGORIES, 
-                                                            index=CLASS_CATEGORIES.index(record['Class Category']))
+                                    class_options, class_index = stored_choice(CLASS_CATEGORIES, CLASS_INDEX, record['Class Category'])
+                                    edit_class = st.selectbox("Class Category", class_options, index=class_index)
                                     edit_section = st.text_input("Class Section", value=record['Class Section'])
-                                    edit_month = st.selectbox("Month", [
-                                        "APRIL", "MAY", "JUNE", "JULY", "AUGUST", "SEPTEMBER",
-                                        "OCTOBER", "NOVEMBER", "DECEMBER", "JANUARY", "FEBRUARY", "MARCH",
-                                        "ANNUAL", "ADMISSION"
-                                    ], index=[
-                                        "APRIL", "MAY", "JUNE", "JULY", "AUGUST", "SEPTEMBER",
-                                        "OCTOBER", "NOVEMBER", "DECEMBER", "JANUARY", "FEBRUARY", "MARCH",
-                                        "ANNUAL", "ADMISSION"
-                                    ].index(record['Month']))
+                                    month_options, month_index = stored_choice(EDIT_MONTHS, MONTH_INDEX, record['Month'])
+                                    edit_month = st.selectbox("Month", month_options, index=month_index)
                                 with col2:
                                     edit_monthly_fee = st.number_input("Monthly Fee", value=float(record['Monthly Fee'] or 0))
                                     edit_annual_charges = st.number_input("Annual Charges", value=float(record['Annual Charges'] or 0))
                                     edit_admission_fee = st.number_input("Admission Fee", value=float(record['Admission Fee'] or 0))
                                     edit_received = st.number_input("Received Amount", value=float(record['Received Amount'] or 0))
-                                    edit_payment_method = st.selectbox("Payment Method", PAYMENT_METHODS, 
-                                                                     index=PAYMENT_METHODS.index(record['Payment Method'] if pd.notna(record['Payment Method']) else "Cash"))
+                                    method_options, method_index = stored_choice(PAYMENT_METHODS, PAYMENT_INDEX, record['Payment Method'] or "Cash")
+                                    edit_payment_method = st.selectbox("Payment Method", method_options, index=method_index)
                                 
-                                try:
-                                    edit_date_value = datetime.strptime(record['Date'], '%d-%m-%Y')
-                                except:
-                                    try:
-                                        edit_date_value = datetime.strptime(record['Date'], '%Y-%m-%d')
-                                    except:
-                                        edit_date_value = datetime.now()
+                                edit_date_value = _parse_date(record['Date']) or datetime.now()
                                 
                                 edit_date = st.date_input("Payment Date", value=edit_date_value)
                                 edit_signature = st.text_input("Received By (Signature)", value=record['Signature'])
                                 edit_academic_year = st.text_input("Academic Year", 
-                                                                 value=record['Academic Year'] if pd.notna(record['Academic Year']) else get_academic_year(edit_date))
+                                                                 value=record['Academic Year'] or get_academic_year(edit_date))
                                 
                                 col1, col2, col3 = st.columns(3)
                                 with col1:
@@ -1449,23 +1795,34 @@ def main_app():
                                     delete_btn = st.form_submit_button("🗑️ Delete Record")
                                 
                                 if update_btn:
-                                    df.loc[edit_index, 'Student Name'] = edit_name
-                                    df.loc[edit_index, 'Class Category'] = edit_class
-                                    df.loc[edit_index, 'Class Section'] = edit_section
-                                    df.loc[edit_index, 'Month'] = edit_month
-                                    df.loc[edit_index, 'Monthly Fee'] = edit_monthly_fee
-                                    df.loc[edit_index, 'Annual Charges'] = edit_annual_charges
-                                    df.loc[edit_index, 'Admission Fee'] = edit_admission_fee
-                                    df.loc[edit_index, 'Received Amount'] = edit_received
-                                    df.loc[edit_index, 'Payment Method'] = edit_payment_method
-                                    df.loc[edit_index, 'Date'] = edit_date.strftime('%d-%m-%Y')
-                                    df.loc[edit_index, 'Signature'] = edit_signature
-                                    df.loc[edit_index, 'Academic Year'] = edit_academic_year
-                                    df.loc[edit_index, 'Entry Timestamp'] = datetime.now().strftime('%d-%m-%Y %H:%M')
+                                    edits = {
+                                        'Student Name': edit_name,
+                                        'Class Category': edit_class,
+                                        'Class Section': edit_section,
+                                        'Month': edit_month,
+                                        'Monthly Fee': edit_monthly_fee,
+                                        'Annual Charges': edit_annual_charges,
+                                        'Admission Fee': edit_admission_fee,
+                                        'Received Amount': edit_received,
+                                        'Payment Method': edit_payment_method,
+                                        'Date': edit_date.strftime('%d-%m-%Y'),
+                                        'Signature': edit_signature,
+                                        'Academic Year': edit_academic_year
+                                    }
+                                    # Blank inputs match missing values, so an untouched form doesn't count as an edit
+                                    changed = {col: value for col, value in edits.items()
+                                               if not (record[col] == value or (record[col] is None and value in ("", None)))}
                                     
-                                    if update_data(df):
-                                        st.success("✅ Record updated successfully!")
-                                        st.rerun()
+                                    if not changed:
+                                        st.info("No changes to save.")
+                                    else:
+                                        df = df.copy()
+                                        changed['Entry Timestamp'] = datetime.now().strftime('%d-%m-%Y %H:%M')
+                                        df.loc[edit_index, list(changed)] = list(changed.values())
+                                        
+                                        if update_data(df):
+                                            st.success("✅ Record updated successfully!")
+                                            st.rerun()
                                 
                                 if delete_btn:
                                     df = df.drop(index=edit_index)
@@ -1473,48 +1830,45 @@ def main_app():
                                         st.success("✅ Record deleted successfully!")
                                         st.rerun()
                         
-                        st.dataframe(
-                            df.style.apply(style_row, axis=1).format({
-                                'Monthly Fee': format_currency,
-                                'Annual Charges': format_currency,
-                                'Admission Fee': format_currency,
-                                'Received Amount': format_currency
-                            }),
-                            use_container_width=True
-                        )
+                        page_count = max(1, -(-len(df) // PAGE_SIZE))
+                        if st.session_state.get("records_page", 1) > page_count:
+                            # Deleting records can leave the remembered page past the end
+                            st.session_state.records_page = page_count
+                        page = st.number_input("Page", min_value=1, max_value=page_count, value=1, key="records_page")
+                        st.caption(f"Showing page {page} of {page_count} ({len(df)} records)")
+                        st.dataframe(records_display(df.iloc[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]),
+                                     use_container_width=True)
+                    
+                    # One pass over the records for every class tab
+                    by_class = df.groupby('Class Category', sort=False, observed=True)
+                    class_frames = dict(list(by_class))
+                    student_counts = by_class['Student Name'].nunique()
+                    received_totals = by_class['Received Amount'].sum()
+                    unpaid_counts = df[df['Monthly Fee'] == 0].groupby('Class Category', observed=True)['Student Name'].nunique()
+                    monthly_by_class = df.groupby(['Class Category', 'Month'], observed=True)['Received Amount'].sum()
                     
                     for i, category in enumerate(CLASS_CATEGORIES, start=1):
                         with tabs[i]:
                             st.subheader(f"{category} Records")
-                            class_df = df[df['Class Category'] == category]
+                            class_df = class_frames.get(category)
                             
-                            if not class_df.empty:
-                                st.dataframe(
-                                    class_df.style.apply(style_row, axis=1).format({
-                                        'Monthly Fee': format_currency,
-                                        'Annual Charges': format_currency,
-                                        'Admission Fee': format_currency,
-                                        'Received Amount': format_currency
-                                    }),
-                                    use_container_width=True
-                                )
+                            if class_df is not None:
+                                st.dataframe(records_display(class_df), use_container_width=True)
                                 
                                 st.subheader("Summary")
                                 col1, col2, col3 = st.columns(3)
                                 with col1:
-                                    st.metric("Total Students", class_df['Student Name'].nunique())
+                                    st.metric("Total Students", int(student_counts[category]))
                                 with col2:
-                                    st.metric("Total Received", format_currency(class_df['Received Amount'].sum()))
+                                    st.metric("Total Received", format_currency(received_totals[category]))
                                 with col3:
-                                    unpaid = class_df[class_df['Monthly Fee'] == 0]['Student Name'].nunique()
-                                    st.metric("Unpaid Students", unpaid, delta_color="inverse")
+                                    st.metric("Unpaid Students", int(unpaid_counts.get(category, 0)), delta_color="inverse")
                                 
                                 st.markdown("Monthly Collection:")
-                                monthly_summary = class_df.groupby('Month')['Received Amount'].sum().reset_index()
-                                st.bar_chart(monthly_summary.set_index('Month'))
+                                st.bar_chart(monthly_by_class.loc[category].to_frame())
                     
                     st.divider()
-                    csv = df.to_csv(index=False).encode('utf-8')
+                    csv = _csv_bytes(df)
                     st.download_button(
                         label="📥 Download All Records as CSV",
                         data=csv,
@@ -1531,51 +1885,45 @@ def main_app():
                 else:
                     all_students = df[['ID', 'Student Name', 'Class Category']].drop_duplicates()
                     
-                    MONTHS = [
-                        "APRIL", "MAY", "JUNE", "JULY", "AUGUST", "SEPTEMBER",
-                        "OCTOBER", "NOVEMBER", "DECEMBER", "JANUARY", "FEBRUARY", "MARCH"
-                    ]
-                    
-                    all_combinations = pd.DataFrame([
-                        (student['ID'], student['Student Name'], student['Class Category'], month)
-                        for _, student in all_students.iterrows()
-                        for month in MONTHS
-                    ], columns=['ID', "Student Name", "Class Category", "Month"])
+                    all_combinations = all_students.merge(pd.DataFrame({'Month': ALL_MONTHS}), how='cross')
                     
                     payment_records = df[["ID", "Month", "Monthly Fee", "Received Amount"]]
                     merged = pd.merge(all_combinations, payment_records, on=["ID", "Month"], how="left")
                     
                     fees_data = load_student_fees()
                     
-                    def get_student_fee(student_id):
-                        if student_id in fees_data:
-                            return fees_data[student_id]["monthly_fee"]
-                        student_payments = df[(df['ID'] == student_id) & (df['Monthly Fee'] > 0)]
-                        if not student_payments.empty:
-                            return student_payments['Monthly Fee'].iloc[-1]
-                        return 2000
-                        
-                    merged['Estimated Monthly Fee'] = merged['ID'].apply(get_student_fee)
+                    # Fee settings win, then the student's last paid monthly fee, then the default
+                    last_fee = (df[df['Monthly Fee'] > 0].drop_duplicates('ID', keep='last')
+                                .set_index('ID')['Monthly Fee'].to_dict())
+                    fee_lookup = {
+                        student_id: fees_data[student_id]["monthly_fee"] if student_id in fees_data
+                        else last_fee.get(student_id, 2000)
+                        for student_id in all_students['ID']
+                    }
+                    merged['Estimated Monthly Fee'] = merged['ID'].map(fee_lookup)
                         
-                    merged['Status'] = merged['Monthly Fee'].apply(
-                        lambda x: "Paid" if pd.notna(x) and x > 0 else "Unpaid"
-                    )
-                    merged['Outstanding'] = merged.apply(
-                        lambda row: 0 if row['Status'] == "Paid" else row['Estimated Monthly Fee'],
-                        axis=1
-                    )
+                    paid = merged['Monthly Fee'].gt(0).to_numpy()
+                    merged['Status'] = np.where(paid, "Paid", "Unpaid")
+                    merged['Outstanding'] = np.where(paid, 0, merged['Estimated Monthly Fee'])
+                    
+                    # One pass over merged for every month tab; paid rows carry no outstanding balance
+                    by_month = merged.assign(paid=paid.astype('int8')).groupby('Month', sort=False)
+                    month_frames = dict(list(by_month))
+                    month_stats = by_month.agg(
+                        total=('paid', 'size'), paid=('paid', 'sum'), outstanding=('Outstanding', 'sum'))
                         
-                    tabs = st.tabs(MONTHS)
+                    tabs = st.tabs(list(ALL_MONTHS))
                         
-                    for i, month in enumerate(MONTHS):
+                    for i, month in enumerate(ALL_MONTHS):
                         with tabs[i]:
-                            month_data = merged[merged['Month'] == month].copy()
+                            month_data = month_frames.get(month)
                                 
-                            if not month_data.empty:
-                                total_students = len(month_data)
-                                paid_students = len(month_data[month_data["Status"] == "Paid"])
+                            if month_data is not None:
+                                stats = month_stats.loc[month]
+                                total_students = int(stats['total'])
+                                paid_students = int(stats['paid'])
                                 unpaid_students = total_students - paid_students
-                                total_outstanding = month_data[month_data["Status"] == "Unpaid"]["Outstanding"].sum()
+                                total_outstanding = stats['outstanding']
                                     
                                 col1, col2, col3 = st.columns(3)
                                 with col1:
@@ -1609,7 +1957,7 @@ def main_app():
                                     use_container_width=True
                                 )
                                         
-                                csv = display_df.to_csv(index=False).encode("utf-8")
+                                csv = _csv_bytes(display_df)
                                 st.download_button(
                                     label=f"📥 Download {month} Data",
                                     data=csv,
@@ -1617,51 +1965,50 @@ def main_app():
                                     mime="text/csv",
                                     key=f"download_month_{month.lower()}"
                                 )
-                            
-                            st.subheader("Overall Payment Status")
-                            student_summary = merged.groupby(["ID", "Student Name", "Class Category"]).agg({
-                                "Status": lambda x: (x == "Unpaid").sum(),
-                                "Outstanding": "sum"
-                            }).reset_index()
-                            student_summary.columns = [
-                                "ID", "Student Name", "Class Category", "Unpaid Months", "Total Outstanding"
-                            ]
                     
-                            st.dataframe(
-                                student_summary.style.format({
-                                    "Total Outstanding": format_currency
-                                }),
-                                use_container_width=True
-                            )
-                                    
-                            csv = student_summary.to_csv(index=False).encode("utf-8")
-                            st.download_button(
-                                label="📥 Download All Records as CSV",
-                                data=csv,
-                                file_name=f"all_fee_records_{st.session_state.school_name or st.session_state.current_user}.csv",
-                                mime="text/csv",
-                                key="download_all_records"
-                            )
+                    st.subheader("Overall Payment Status")
+                    student_summary = merged.groupby(["ID", "Student Name", "Class Category"], observed=True).agg({
+                        "Status": lambda x: (x == "Unpaid").sum(),
+                        "Outstanding": "sum"
+                    }).reset_index()
+                    student_summary.columns = [
+                        "ID", "Student Name", "Class Category", "Unpaid Months", "Total Outstanding"
+                    ]
+            
+                    st.dataframe(
+                        student_summary.style.format({
+                            "Total Outstanding": format_currency
+                        }),
+                        use_container_width=True
+                    )
+                            
+                    csv = _csv_bytes(student_summary)
+                    st.download_button(
+                        label="📥 Download All Records as CSV",
+                        data=csv,
+                        file_name=f"all_fee_records_{st.session_state.school_name or st.session_state.current_user}.csv",
+                        mime="text/csv",
+                        key="download_all_records"
+                    )
             
             elif menu == "Student Yearly Report":
                 st.header("📊 Student Yearly Fee Report")
                 
-                df = load_data()
+                df, student_rows, students_by_class = load_student_index()
                 if df.empty:
                     st.info("No fee records found")
                 else:
-                    all_classes = sorted(df["Class Category"].unique())
+                    all_classes = sorted(students_by_class)
                     selected_class = st.selectbox("Select Class", all_classes, key="class_selector")
                     
-                    class_students = sorted(df[df["Class Category"] == selected_class]["Student Name"].unique())
+                    class_students = students_by_class.get(selected_class, [])
                     
                     if not class_students:
                         st.warning(f"No students found in {selected_class}")
                     else:
                         selected_student = st.selectbox("Select Student", class_students, key="student_selector")
                         
-                        student_data = df[(df["Student Name"] == selected_student) & 
-                                        (df["Class Category"] == selected_class)]
+                        student_data = df.iloc[student_rows.get((selected_class, selected_student), [])]
                         
                         if student_data.empty:
                             st.warning(f"No records found for {selected_student} in {selected_class}")
@@ -1693,22 +2040,14 @@ def main_app():
                             
                             st.subheader("Monthly Fee Details")
                             
-                            all_months = [
-                                "APRIL", "MAY", "JUNE", "JULY", "AUGUST", "SEPTEMBER",
-                                "OCTOBER", "NOVEMBER", "DECEMBER", "JANUARY", "FEBRUARY", "MARCH"
-                            ]
-                            
-                            monthly_report = pd.DataFrame({"Month": all_months})
-                            monthly_data = student_data.groupby("Month").agg({
+                            monthly_report = pd.DataFrame({"Month": ALL_MONTHS})
+                            monthly_data = student_data.groupby("Month", observed=True).agg({
                                 "Monthly Fee": "sum",
                                 "Received Amount": "sum"
                             }).reset_index()
                             
                             monthly_report = monthly_report.merge(monthly_data, on="Month", how="left").fillna(0)
-                            monthly_report["Status"] = monthly_report.apply(
-                                lambda row: "Paid" if row["Monthly Fee"] > 0 else "Unpaid",
-                                axis=1
-                            )
+                            monthly_report["Status"] = np.where(monthly_report["Monthly Fee"] > 0, "Paid", "Unpaid")
                             
                             def color_unpaid(val):
                                 if val == "Unpaid":
@@ -1729,7 +2068,7 @@ def main_app():
                             st.line_chart(monthly_report.set_index("Month")[["Monthly Fee", "Received Amount"]])
                             
                             st.divider()
-                            csv = monthly_report.to_csv(index=False).encode("utf-8")
+                            csv = _csv_bytes(monthly_report)
                             st.download_button(
                                 label="📥 Download Student Report",
                                 data=csv,
@@ -1741,6 +2080,8 @@ def main_app():
                 user_management()
 
 def main():
+    # Page config must be set once per full run, outside the page fragments
+    st.set_page_config(page_title="School Fees Management", layout="wide", page_icon="🏫")
     initialize_files()
     
     if 'show_login' not in st.session_state: